@@ -27,18 +27,17 @@ The names of items in the description should closely match the names in the bill
 Final output will be each person's share to the total amount in the bill.
 """
 
-import csv
-import re
 import random
-from collections import Counter, defaultdict
-from csv import DictReader
+import sys
+from collections import defaultdict
 from dataclasses import dataclass
-from difflib import get_close_matches
-from fractions import Fraction
+from functools import lru_cache
 from pathlib import Path
 from pprint import pprint
 from typing import Iterable
 
+from rapidfuzz import fuzz, process
+
 # These are the ONLY variables that you need to change.
 # could even be a file inside a directory, like "./bills/Greed Island/foo"
 # just ensure that foo.bill and foo.expenses exist in that directory
@@ -55,13 +54,13 @@ bill_path = BASE_PATH.with_suffix(".bill")
 expenses_data = BASE_PATH.with_suffix(".expenses").read_text()
 
 
-@dataclass
+@dataclass(slots=True)
 class BillItem:
     name: str
-    price: Fraction
+    price: float
     quantity: int = 1
 
-    def scale_price(self, multiplier: Fraction):
+    def scale_price(self, multiplier: float):
         return BillItem(self.name, self.price * multiplier, self.quantity)
 
 
@@ -73,90 +72,124 @@ def parse_bill(path: Path):
     assert (
         lines[0].strip().startswith("!paid")
     ), "First line should be paid amount directive. Eg: '!paid: 1234.00'"
-    total_paid = Fraction(lines[0].split(":")[1].strip())
-
-    # now parse the item lines
-    bill_data2 = DictReader(
-        [line for line in lines if line.strip() and not line.startswith("!")],
-        fieldnames=["quantity", "name", "price"],
-        dialect=csv.excel_tab,
-    )
+    total_paid = float(lines[0].split(":")[1].strip())
 
-    items = [
-        BillItem(r['name'], Fraction(r['price'].replace(',', '')), int(r['quantity']))
-        for r in bill_data2
-    ]
+    # now parse the item lines (columns: quantity, name, price)
+    # plain tab-splitting; the input has no quoting for csv to worry about
+    items = []
+    for line in lines[1:]:
+        if not line.strip() or line.startswith("!"):
+            continue
+        quantity, name, price = line.split("\t")
+        items.append(BillItem(sys.intern(name), float(price.replace(',', '')), int(quantity)))
     # adjust the prices based on actual amount paid
     item_sum = sum(item.price for item in items)
     price_mult = total_paid / item_sum
-    print(f"bill sum: {float(item_sum):.2f}")
+    print(f"bill sum: {item_sum:.2f}")
     return total_paid, [item.scale_price(price_mult) for item in items]
 
 
 EVERYONE_NAME = "@everyone"
-MULT_PAT = re.compile(r'(?P<name>.*?)\s+x(?P<mult>\d+)$')
 
 
-@dataclass
+@dataclass(slots=True)
 class Person:
     name: str
     negate: bool = False
     multiplier: int = 1
+    # whether the "name" is actually a group alias (like "@kids");
+    # computed once at parse time so the hot loops don't rescan the string
+    is_alias: bool = False
 
     @staticmethod
     def from_names(names: Iterable[str]):
-        return [Person(name) for name in names]
+        return [Person(sys.intern(name)) for name in names]
 
     def expand_alias(self, names: set[str]):
-        return [Person(name, self.negate, self.multiplier) for name in names]
+        return [Person(sys.intern(name), self.negate, self.multiplier) for name in names]
 
 
-EVERYONE = Person(EVERYONE_NAME)
+EVERYONE = Person(EVERYONE_NAME, is_alias=True)
 
 
-def parse_people(names_str: str) -> tuple[list[Person], list[Person]]:
+def parse_people(names_str: str) -> list[Person]:
+    # aliases and plain names share the list; Person.is_alias tells them apart
     people: list[Person] = []
-    aliases: list[Person] = []
     for person in names_str.strip(", ").split(","):
         person = person.strip()
         if person == EVERYONE_NAME:
-            aliases.append(EVERYONE)
+            people.append(EVERYONE)
             continue
         neg = False
         if person.startswith("-"):
             neg = True
             person = person.lstrip("-").lstrip()
-        collection = aliases if '@' in person else people
-        if match := MULT_PAT.match(person):
-            collection.append(Person(match['name'], neg, int(match['mult'])))
+        is_alias = '@' in person
+        # "Leorio x2" style multiplier suffix; plain str ops beat a regex here
+        name, sep, mult = person.rpartition(" x")
+        if sep and mult.isdigit():
+            people.append(Person(sys.intern(name.rstrip()), neg, int(mult), is_alias))
         else:
-            collection.append(Person(person, neg))
-    return people, aliases
+            people.append(Person(sys.intern(person), neg, is_alias=is_alias))
+    return people
+
+
+def new_bean_directives():
+    """An empty set of '!bean-*' directives, see gen_beancount_postings."""
+    return {"names": {}, "me": None, "unknown": None, "total": None, "parse_error": False}
+
+
+def parse_bean_directive(line: str, directives: dict):
+    """Parse a single '!bean-*' line into the directives dict."""
+    def parse_kv(line, prefix):
+        return tuple(a.strip() for a in line.removeprefix(prefix).strip().split("="))
+
+    if line.startswith("!bean-name:"):
+        try:
+            name, account = parse_kv(line, "!bean-name:")
+        except ValueError as e:
+            print(f"Failed to parse bean name at {line}: {e}")
+            directives["parse_error"] = True
+            return
+        directives["names"][name] = account
+    elif line.startswith("!bean-name-me:"):
+        try:
+            directives["me"] = parse_kv(line, "!bean-name-me:")
+        except ValueError as e:
+            print(f"Failed to parse bean name at {line}: {e}")
+            directives["parse_error"] = True
+    elif line.startswith("!bean-unknown:"):
+        directives["unknown"] = line.removeprefix("!bean-unknown:").strip()
+    elif line.startswith("!bean-total:"):
+        directives["total"] = line.removeprefix("!bean-total:").strip()
 
 
 def parse_expenses(data: str):
     cat_people = None
-    cat_aliases = None
     aliases = defaultdict(set)
+    # names destined for @everyone; buffered and unioned once after the loop
+    everyone_buf: list[str] = []
     items: dict[str, list[Person]] = {}
+    bean_directives = new_bean_directives()
     for line in data.splitlines():
         if not line:
             continue
 
         if line.startswith('!'):
-            # this is a comment line
+            # comment line; may carry a bean directive, collect it in this
+            # same pass instead of re-walking the file later
+            parse_bean_directive(line, bean_directives)
             continue
 
         if line.startswith('@'):
             # parsing a group alias
             split = line.split(":")
             alias = split[0].strip()
-            persons, parsed_aliases = parse_people(split[1].strip())
-            aliases[alias].update(name.name for name in persons)
+            persons = parse_people(split[1].strip())
             # we will have another pass to resolve all aliases
             # for now, we don't allow alias negations, multipliers
-            assert not any(a.negate or a.multiplier != 1 for a in parsed_aliases)
-            aliases[alias].update(a.name for a in parsed_aliases)
+            assert not any(p.is_alias and (p.negate or p.multiplier != 1) for p in persons)
+            aliases[alias].update(p.name for p in persons)
             continue
 
         if line.startswith("#"):
@@ -164,67 +197,88 @@ def parse_expenses(data: str):
             split = line.split(":")
             if len(split) > 1:
                 # names of people
-                cat_people, cat_aliases = parse_people(split[1].strip())
-                aliases[EVERYONE_NAME].update(name.name for name in cat_people)
+                cat_people = parse_people(split[1].strip())
+                everyone_buf.extend(p.name for p in cat_people if not p.is_alias)
             else:
                 # reset the cat_people
                 cat_people = None
-                cat_aliases = None
             continue
         # now at a food line
         split = line.split(":")
         item_name = split[0].strip()
         if len(split) == 1:
-            assert (
-                cat_people is not None
-                and cat_aliases is not None
-                and (cat_people or cat_aliases)
-            ), f"no category people/aliases defined for food item {line}"
-            cur_all = cat_people + cat_aliases
+            assert cat_people, f"no category people/aliases defined for food item {line}"
+            cur_all = cat_people
         else:
-            cur_people, cur_aliases = parse_people(split[1].strip())
-            aliases[EVERYONE_NAME].update(name.name for name in cur_people)
-            cur_all = cur_people + cur_aliases
+            cur_all = parse_people(split[1].strip())
+            everyone_buf.extend(p.name for p in cur_all if not p.is_alias)
         items[item_name] = cur_all
 
+    aliases[EVERYONE_NAME].update(everyone_buf)
     aliases = resolve_aliases(aliases)
-    return finalize_names(items, aliases)
+    return finalize_names(items, aliases), bean_directives
 
 
 def resolve_aliases(aliases: dict[str, set[str]]):
-    """Expand all aliases recursively till they only contain names.
+    """Expand all aliases till they only contain names.
     Plms don't give cyclic.
+
+    Single-pass topological resolution: aliases that are already plain
+    names get substituted into their dependents, which may in turn
+    become plain, and so on.
     """
-    if all(all('@' not in name for name in v) for v in aliases.values()):
-        # Done!
-        return aliases
-    new_aliases = {}
+    # alias -> aliases it still references; only the dirty ones need tracking
+    deps: dict[str, set[str]] = {}
     for name, people in aliases.items():
-        new_people = people.copy()
-        for alias in [n for n in people if '@' in n]:
-            new_people.remove(alias)
-            new_people.update(aliases[alias])
-        new_aliases[name] = new_people
-    return resolve_aliases(new_aliases)
+        refs = {n for n in people if '@' in n}
+        if refs:
+            deps[name] = refs
+    if not deps:
+        # common case: nothing references another alias
+        return aliases
+    # only copy the sets we will actually mutate
+    new_aliases = {
+        name: people.copy() if name in deps else people
+        for name, people in aliases.items()
+    }
+    dependents = defaultdict(set)
+    for name, refs in deps.items():
+        for ref in refs:
+            dependents[ref].add(name)
+    ready = [name for name in dependents if name not in deps]
+    while ready:
+        done = ready.pop()
+        for dependent in dependents.pop(done, ()):
+            people = new_aliases[dependent]
+            people.remove(done)
+            people.update(new_aliases[done])
+            refs = deps[dependent]
+            refs.remove(done)
+            if not refs:
+                del deps[dependent]
+                ready.append(dependent)
+    assert not deps, f"unresolvable (cyclic?) aliases: {deps}"
+    return new_aliases
 
 
 def finalize_names(items: dict[str, list[Person]], aliases: dict[str, set[str]]):
     # do a second pass to handle negations and "@everyone"
     # our final return value will only have the names and their multipliers
-    final_items: dict[str, Counter] = {}
-    for item, names in items.copy().items():
-        final_names: Counter[str] = Counter()
-        removed_names = Counter()
+    final_items: dict[str, dict[str, int]] = {}
+    for item, names in items.items():
+        final_names: defaultdict[str, int] = defaultdict(int)
+        removed_names: defaultdict[str, int] = defaultdict(int)
         if any(name.negate for name in names) and not any(
-            ('@' in name.name) for name in names
+            name.is_alias for name in names
         ):
             # if there are negations, and no alias has been provided,
             # need to add EVERYONE implicitly. the negations will be removed later
-            final_names.update(aliases[EVERYONE_NAME])
+            for name in aliases[EVERYONE_NAME]:
+                final_names[name] += 1
         # first, expand all the aliases
         expanded_names = []
         for person in names:
-            if '@' in person.name:
+            if person.is_alias:
                 people = aliases[person.name]
                 expanded_names.extend(person.expand_alias(people))
             else:
@@ -235,7 +289,10 @@ def finalize_names(items: dict[str, list[Person]], aliases: dict[str, set[str]])
                 removed_names[person.name] += person.multiplier
             else:
                 final_names[person.name] += person.multiplier
-        final_names -= removed_names
+        for name, count in removed_names.items():
+            final_names[name] -= count
+        # like Counter subtraction, keep only the positive counts
+        final_names = {name: count for name, count in final_names.items() if count > 0}
         assert not any(
             name.startswith("@") for name in final_names
         ), "found alias in final_names"
@@ -246,6 +303,7 @@ def finalize_names(items: dict[str, list[Person]], aliases: dict[str, set[str]])
     return final_items
 
 
+@lru_cache(maxsize=None)
 def is_sampler(name):
     return name.lower().startswith("sampler")
 
@@ -266,22 +324,110 @@ def round_totals(shares):
     assert round(sum(totals.values()) - total, 2) == 0, f"Failed to round off the {shares=}"
     return totals
 
-def assign_shares(items: dict[str, Counter[str]], bill: list[BillItem]):
-    samplers = [name for name in items.keys() if is_sampler(name)]
-    shares = defaultdict(Fraction)
+def bigrams(name: str) -> set[str]:
+    return {name[i:i + 2] for i in range(len(name) - 1)}
+
+
+# a bigram-overlap match is accepted outright if the best candidate's
+# containment score clears this and beats the runner-up by the margin
+BIGRAM_CUTOFF = 0.8
+BIGRAM_MARGIN = 0.1
+
+
+def resolve_matches(bill: list[BillItem], items: dict[str, dict[str, int]]):
+    """Map each bill item name to its expenses key.
+
+    Tiered matching: exact (case-insensitive) hits are answered from a dict,
+    near-exact ones from a cheap bigram-overlap index, and only the ambiguous
+    leftovers are fuzzy-scored, in a single process.cdist call instead of
+    re-entering rapidfuzz once per bill item.
+    """
+    # normalize the candidate names once, instead of once per bill item
+    normalized_candidates = {k.lower().strip(): k for k in items}
+    candidate_keys = list(normalized_candidates)
+    sampler_cols = [i for i, k in enumerate(candidate_keys) if is_sampler(k)]
+    # bigram -> columns of candidates containing it
+    key_bigrams = [bigrams(k) for k in candidate_keys]
+    bigram_index: defaultdict[str, set[int]] = defaultdict(set)
+    for col, grams in enumerate(key_bigrams):
+        for gram in grams:
+            bigram_index[gram].add(col)
+
+    def bigram_match(name: str, sampler: bool):
+        """Column of the dominant bigram-overlap candidate, None if ambiguous."""
+        grams = bigrams(name)
+        if not grams:
+            return None
+        overlaps: defaultdict[int, int] = defaultdict(int)
+        for gram in grams:
+            for col in bigram_index.get(gram, ()):
+                overlaps[col] += 1
+        if sampler:
+            overlaps = {c: n for c, n in overlaps.items() if is_sampler(candidate_keys[c])}
+        # single-pass max; only the best and runner-up scores matter
+        best_col = None
+        best = second = 0.0
+        for col, count in overlaps.items():
+            score = count / min(len(grams), len(key_bigrams[col]))
+            if score > best:
+                best, second, best_col = score, best, col
+            elif score > second:
+                second = score
+        if best < BIGRAM_CUTOFF or best - second < BIGRAM_MARGIN:
+            return None
+        return best_col
+
+    matches: dict[str, str] = {}
+    pending: dict[str, BillItem] = {}
+    for bill_item in bill:
+        if bill_item.name in matches or bill_item.name in pending:
+            # repeated bill line, resolve it only once
+            continue
+        # fast path: an exact hit needs no fuzzy matching
+        bill_name = bill_item.name.lower().strip()
+        matched = normalized_candidates.get(bill_name)
+        if matched is None:
+            # second tier: accept a clearly dominant bigram overlap
+            col = bigram_match(bill_name, is_sampler(bill_item.name))
+            if col is not None:
+                matched = normalized_candidates[candidate_keys[col]]
+        if matched is None:
+            pending[bill_item.name] = bill_item
+        else:
+            matches[bill_item.name] = matched
+
+    if pending:
+        scores = process.cdist(
+            [name.lower().strip() for name in pending],
+            candidate_keys,
+            scorer=fuzz.WRatio,
+        )
+        for bill_item, row in zip(pending.values(), scores):
+            if is_sampler(bill_item.name):
+                # samplers only ever match sampler items
+                assert sampler_cols, f"no sampler candidates for {bill_item}"
+                best = sampler_cols[row[sampler_cols].argmax()]
+            else:
+                best = row.argmax()
+            assert row[best] >= 50, (
+                f"no match for {bill_item} in {', '.join(normalized_candidates.values())}"
+            )
+            matches[bill_item.name] = normalized_candidates[candidate_keys[best]]
+    return matches
+
+
+def assign_shares(items: dict[str, dict[str, int]], bill: list[BillItem]):
+    matches = resolve_matches(bill, items)
+    shares = defaultdict(float)
     details = defaultdict(dict)
 
     for bill_item in bill:
-        candidates = items.keys()
-        if is_sampler(bill_item.name):
-            candidates = samplers
-        matches = get_close_matches(bill_item.name, candidates, n=1, cutoff=0.5)
-        assert matches, f"no match for {bill_item} in {', '.join(candidates)}"
-        people = items[matches[0]]
-        assert people.total(), f"No person for {bill_item}"
-        per_person = bill_item.price / Fraction(people.total())
+        people = items[matches[bill_item.name]]
+        total_mult = sum(people.values())
+        assert total_mult, f"No person for {bill_item}"
+        per_person = bill_item.price / total_mult
         for person, mult in people.items():
-            share = per_person * Fraction(mult)
+            share = per_person * mult
             shares[person] += share
             details[person][bill_item.name] = share
 
@@ -298,35 +444,13 @@ def assign_shares(items: dict[str, Counter[str]], bill: list[BillItem]):
     return totals
 
 
-def gen_beancount_postings(total_paid: Fraction, totals: dict, expenses_data: str):
-    account_names = {}
-    my_name = None
-    unknown_name = None
-    total_name = None
-
-    def parse_kv(line, prefix):
-        return tuple(a.strip() for a in line.removeprefix(prefix).strip().split("="))
-
-    # parse the expenses to get !bean-name directives
-    for line in expenses_data.splitlines():
-        if line.startswith("!bean-name:"):
-            try:
-                name, account = parse_kv(line, "!bean-name:")
-            except ValueError as e:
-                print(f"Failed to parse bean name at {line}: {e}")
-                return
-            account_names[name] = account
-        elif line.startswith("!bean-name-me:"):
-            try:
-                my_name = parse_kv(line, "!bean-name-me:")
-            except ValueError as e:
-                print(f"Failed to parse bean name at {line}: {e}")
-                return
-        elif line.startswith("!bean-unknown:"):
-            unknown_name = line.removeprefix("!bean-unknown:").strip()
-        elif line.startswith("!bean-total:"):
-            total_name = line.removeprefix("!bean-total:").strip()
-
+def gen_beancount_postings(total_paid: float, totals: dict, directives: dict):
+    if directives["parse_error"]:
+        return
+    account_names = directives["names"]
+    my_name = directives["me"]
+    unknown_name = directives["unknown"]
+    total_name = directives["total"]
 
     if not all(name in account_names for name in totals if (my_name is None or my_name[0] != name)):
         print("Missing some bean-names!!")
@@ -341,7 +465,7 @@ def gen_beancount_postings(total_paid: Fraction, totals: dict, expenses_data: st
     # start printing
     print("Beancount postings:")
     if total_name is not None:
-        print(total_name, -float(total_paid), "USD")
+        print(total_name, -total_paid, "USD")
 
     for bill_name, total in totals.items():
         if my_name is not None and bill_name == my_name[0]:
@@ -361,10 +485,13 @@ def main():
     # make the RNG consistent for a given bill
     random.seed(str(bill_path))
     total_paid, bill = parse_bill(bill_path)
-    items = parse_expenses(expenses_data)
+    items, bean_directives = parse_expenses(expenses_data)
     totals = assign_shares(items, bill)
     if BEANNAMES_FILE.exists():
-        gen_beancount_postings(total_paid, totals, BEANNAMES_FILE.read_text())
+        for line in BEANNAMES_FILE.read_text().splitlines():
+            parse_bean_directive(line, bean_directives)
+    if bean_directives["names"] or bean_directives["me"] or bean_directives["total"]:
+        gen_beancount_postings(total_paid, totals, bean_directives)
 
 
 if __name__ == '__main__':